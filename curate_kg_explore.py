@@ -10,6 +10,8 @@ import numpy as np
 from sklearn.metrics.pairwise import pairwise_distances
 
 
+from src.rag_utils import get_vdb_storage, get_entity_labels, vdb_frame
+
 from dotenv import load_dotenv
 load_dotenv(r'.env')
 
@@ -31,11 +33,11 @@ async def initialize_rag():
 
 async def main():
     rag = await initialize_rag()
-    entities_vdb = await rag.entities_vdb.client_storage
-    chunk_vdb = await rag.chunks_vdb.client_storage
+    entities_vdb = await get_vdb_storage(rag, "entities_vdb")
+    chunk_vdb = await get_vdb_storage(rag, "chunks_vdb")
 
     # print(entities_vdb)
-    entities_list = await rag.chunk_entity_relation_graph.get_all_labels()
+    entities_list = await get_entity_labels(rag)
     # print(entities_list)
     target_entity = entities_list[0]
     entity_id = compute_mdhash_id(target_entity, prefix="ent-")
@@ -45,27 +47,34 @@ async def main():
     # Get all relationships of the source entities
     edges = await rag.chunk_entity_relation_graph.get_node_edges(target_entity)
     if edges:
-        for src, tgt in edges:
-            # Ensure src is the current entity
-            if src == target_entity:
-                edge_data = await rag.chunk_entity_relation_graph.get_edge(
-                    src, tgt
-                )
-                all_relations.append((src, tgt, edge_data, compute_mdhash_id(src + tgt, prefix="rel-")))
+        # Ensure src is the current entity
+        pairs = [(src, tgt) for src, tgt in edges if src == target_entity]
+        # Fetch all edges concurrently instead of one round-trip at a time
+        edge_datas = await asyncio.gather(
+            *(rag.chunk_entity_relation_graph.get_edge(src, tgt) for src, tgt in pairs)
+        )
+        all_relations = [
+            (src, tgt, edge_data, compute_mdhash_id(src + tgt, prefix="rel-"))
+            for (src, tgt), edge_data in zip(pairs, edge_datas)
+        ]
+
 
+    # Index both vector stores by key once instead of scanning them
+    ent_df = vdb_frame(entities_vdb, 'entity_name')
+    chunk_df = vdb_frame(chunk_vdb, '__id__')
 
-    for i, ent in enumerate(entities_vdb['data']):
-        if ent['entity_name'] == target_entity:
-            print(target_entity)
-            print(entity_id)
-            print(all_relations)
-            print(entities_vdb['data'][i])
-            print(entities_vdb['matrix'][i,:])
-            source_id = entities_vdb['data'][i]['source_id'] 
-            for j, chunk in enumerate(chunk_vdb['data']):
-                if chunk['__id__'] == source_id:
-                    print(chunk)
-                    print(chunk_vdb['matrix'][j,:])
+    if target_entity in ent_df.index:
+        i = ent_df.index.get_loc(target_entity)
+        print(target_entity)
+        print(entity_id)
+        print(all_relations)
+        print(ent_df.iloc[i].to_dict())
+        print(entities_vdb['matrix'][i,:])
+        source_id = ent_df.at[target_entity, 'source_id']
+        if source_id in chunk_df.index:
+            j = chunk_df.index.get_loc(source_id)
+            print(chunk_df.iloc[j].to_dict())
+            print(chunk_vdb['matrix'][j,:])
 
 
 if __name__ == "__main__":
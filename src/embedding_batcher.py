@@ -0,0 +1,89 @@
+"""Batching of concurrent embedding requests into shared embedding calls."""
+
+import asyncio
+from typing import List, Optional, Callable, Awaitable, Tuple
+
+import numpy as np
+
+class EmbedBatcher:
+    """Coalesce concurrent embedding requests into shared embedding calls.
+
+    Callers submit lists of texts; a background task collects requests for up to
+    timeout seconds, as long as the batch stays within max_texts texts and max_tokens
+    tokens, embeds them with one call and resolves each caller with its slice of the
+    result. A request that does not fit is held back for the next batch; a single
+    request over the limits is sent on its own.
+    """
+
+    def __init__(self, embed_func: Callable[[List[str]], Awaitable[np.ndarray]],
+                 count_tokens: Callable[[List[str]], int],
+                 max_texts: int, max_tokens: int, timeout: float):
+        self._embed_func = embed_func
+        self._count_tokens = count_tokens
+        self.max_texts = max_texts
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches = set()
+
+    def _ensure_worker(self) -> None:
+        # The queue and worker belong to one event loop, restart them if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._collect())
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts as part of the next batch."""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        self._queue.put_nowait((texts, self._count_tokens(texts), future))
+        return await future
+
+    async def _collect(self) -> None:
+        held = None
+        while True:
+            first = held if held is not None else await self._queue.get()
+            held = None
+            batch = [first]
+            count, tokens = len(first[0]), first[1]
+            deadline = self._loop.time() + self.timeout
+            while count < self.max_texts and tokens < self.max_tokens:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    break
+                # Check the limits before adding, a request that does not fit starts the next batch
+                if count + len(item[0]) > self.max_texts or tokens + item[1] > self.max_tokens:
+                    held = item
+                    break
+                batch.append(item)
+                count += len(item[0])
+                tokens += item[1]
+
+            # Dispatch in the background so the next batch can be collected meanwhile
+            task = self._loop.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[List[str], int, asyncio.Future]]) -> None:
+        texts = [text for item_texts, _, _ in batch for text in item_texts]
+        try:
+            embeddings = await self._embed_func(texts)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for item_texts, _, future in batch:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(item_texts)])
+            offset += len(item_texts)
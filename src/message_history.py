@@ -0,0 +1,53 @@
+"""Helpers for the conversation history passed to the agent."""
+
+import hashlib
+from typing import List
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    SystemPromptPart,
+    UserPromptPart,
+    TextPart
+)
+
+MAX_HISTORY_MESSAGES = 50  # most recent messages passed to the agent on each turn
+
+def trim_history(history: List[ModelMessage], max_messages: int = MAX_HISTORY_MESSAGES) -> List[ModelMessage]:
+    """Keep the most recent messages of a history to bound the prompt length.
+
+    The trimmed history starts at a user prompt so tool calls stay paired with their
+    returns, and the system prompt of the session is carried over to its first message.
+    """
+    if len(history) <= max_messages:
+        return history
+
+    turn_starts = [
+        i for i, msg in enumerate(history)
+        if isinstance(msg, ModelRequest) and any(isinstance(part, UserPromptPart) for part in msg.parts)
+    ]
+    start = next((i for i in turn_starts if i >= len(history) - max_messages), turn_starts[-1] if turn_starts else 0)
+    if start == 0:
+        return history
+
+    system_parts = [
+        part for msg in history[:start] if isinstance(msg, ModelRequest)
+        for part in msg.parts if isinstance(part, SystemPromptPart)
+    ]
+    first = ModelRequest(parts=system_parts + list(history[start].parts))
+    return [first] + history[start + 1:]
+
+def cache_namespace(user_id: str, context: List[ModelMessage], memory_version: int = 0) -> str:
+    """Scope cached responses to the user and to the conversation context the agent sees.
+
+    The namespace includes a hash of the user prompts and texts of the (trimmed) history,
+    so a question is only answered from the cache when it is asked after the same
+    conversation, e.g. as the opening question of a session. The version of the user's
+    memories is included too, so answers given before a memory write are not reused.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for msg in context:
+        for part in msg.parts:
+            if isinstance(part, (UserPromptPart, TextPart)) and isinstance(part.content, str):
+                digest.update(f"{part.part_kind}\0{part.content}\0".encode("utf-8"))
+    return f"{user_id}:{memory_version}:{digest.hexdigest()}"
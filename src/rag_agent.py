@@ -3,11 +3,17 @@
 import os
 import sys
 import argparse
+import hashlib
+import functools
 from dataclasses import dataclass
 import asyncio
-from typing import Union, AsyncIterator, Iterator, List, Dict, Any, Optional
+from typing import Union, AsyncIterator, Iterator, List, Dict, Any, Optional, Tuple
 
 import dotenv
+import numpy as np
+import tiktoken
+from cachetools import TTLCache, LRUCache
+from redis import asyncio as aioredis
 from pydantic_ai import RunContext
 from pydantic_ai.agent import Agent
 from openai import AsyncOpenAI
@@ -16,7 +22,13 @@ from mem0 import AsyncMemoryClient
 from lightrag import LightRAG, QueryParam
 from lightrag.llm.openai import gpt_4o_mini_complete, openai_embed
 from lightrag.kg.shared_storage import initialize_pipeline_status
-from lightrag.utils import setup_logger
+from lightrag.utils import setup_logger, logger, EmbeddingFunc
+
+try:
+    from embedding_batcher import EmbedBatcher
+except ImportError:
+    # Imported as src.rag_agent from the repository root
+    from src.embedding_batcher import EmbedBatcher
 
 # Setup logger for LightRAG
 setup_logger("lightrag", level="INFO")
@@ -47,11 +59,214 @@ mem0_client = AsyncMemoryClient(
     project_id=os.getenv("MEM0_PROJECT_ID")
 )
 
+# Mem0 request configuration
+MEMORY_SEARCH_CACHE_SIZE = 4096
+MEMORY_SEARCH_CACHE_TTL = 30  # seconds a search result is reused for the same query and user
+MEMORY_ADD_FLUSH_DELAY = 0.2  # seconds to collect memory writes of a user into one request
+MEMORY_VERSION_KEY_PREFIX = "memory_version"  # per-user Redis counter, bumped on every memory write
+
+# Pending or recent Mem0 searches keyed by (user_id, query hash)
+_memory_search_cache: TTLCache = TTLCache(maxsize=MEMORY_SEARCH_CACHE_SIZE, ttl=MEMORY_SEARCH_CACHE_TTL)
+
+def start_memory_search(client: AsyncMemoryClient, query: str, user_id: str) -> asyncio.Future:
+    """Start a Mem0 search, or return the pending or recent search for the same query and user."""
+    key = (user_id, hashlib.sha256(query.encode('utf-8')).hexdigest())
+    task = _memory_search_cache.get(key)
+    if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+        task = asyncio.ensure_future(client.search(query, user_id=user_id))
+        _memory_search_cache[key] = task
+    return task
+
+async def search_memories(client: AsyncMemoryClient, query: str, user_id: str) -> List[Dict[str, Any]]:
+    """Search Mem0 memories, sharing results of identical searches within a short window."""
+    # Shield the shared task so a cancelled caller does not cancel it for the others
+    return await asyncio.shield(start_memory_search(client, query, user_id))
+
+def invalidate_memory_searches(user_id: str) -> None:
+    """Drop cached searches of a user after their memories changed."""
+    for key in [key for key in _memory_search_cache if key[0] == user_id]:
+        _memory_search_cache.pop(key, None)
+
+
+class MemoryWriteBuffer:
+    """Coalesce Mem0 add calls of the same user into one request.
+    
+    Messages added within delay seconds of the first pending add are sent together;
+    every caller receives the result of the shared request.
+    """
+    
+    def __init__(self, delay: float = MEMORY_ADD_FLUSH_DELAY):
+        self.delay = delay
+        self._pending: Dict[str, Tuple[List[Dict[str, str]], asyncio.Future]] = {}
+        self._flushes = set()
+    
+    async def add(self, client: AsyncMemoryClient, messages: Union[List[Dict[str, str]], str], user_id: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        if user_id not in self._pending:
+            self._pending[user_id] = ([], loop.create_future())
+            loop.call_later(self.delay, self._schedule_flush, client, user_id)
+        
+        pending_messages, result = self._pending[user_id]
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        pending_messages.extend(messages)
+        return await asyncio.shield(result)
+    
+    def _schedule_flush(self, client: AsyncMemoryClient, user_id: str) -> None:
+        task = asyncio.ensure_future(self._flush(client, user_id))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+    
+    async def _flush(self, client: AsyncMemoryClient, user_id: str) -> None:
+        messages, result = self._pending.pop(user_id)
+        try:
+            response = await client.add(messages, user_id=user_id)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(response)
+        finally:
+            invalidate_memory_searches(user_id)
+            await bump_memory_version(user_id)
+
+memory_writes = MemoryWriteBuffer()
+
+# Embedding cache configuration
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_CACHE_PREFIX = "embedding"
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL") or 0) or None  # seconds, None keeps embeddings forever
+EMBEDDING_LOCAL_CACHE_SIZE = 4096  # embeddings kept in process memory in front of Redis
+
+_redis_client: Optional[aioredis.Redis] = None
+
+def get_redis_client() -> aioredis.Redis:
+    """Return the shared async Redis client used for caching."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = aioredis.from_url(os.getenv("REDIS_URI", "redis://localhost:6379"))
+    return _redis_client
+
+async def get_memory_version(user_id: str) -> int:
+    """Return the version of a user's memories, so caches built on them can be scoped to it."""
+    try:
+        version = await get_redis_client().get(f"{MEMORY_VERSION_KEY_PREFIX}:{user_id}")
+    except Exception as e:
+        print(f"Error reading memory version: {str(e)}")
+        return 0
+    return int(version or 0)
+
+async def bump_memory_version(user_id: str) -> None:
+    """Mark a user's memories as changed."""
+    try:
+        await get_redis_client().incr(f"{MEMORY_VERSION_KEY_PREFIX}:{user_id}")
+    except Exception as e:
+        print(f"Error updating memory version: {str(e)}")
+
+
+# Embedding request batching configuration
+EMBED_BATCH_MAX_TEXTS = 256  # texts per OpenAI request
+EMBED_BATCH_MAX_TOKENS = 250_000  # tokens per OpenAI request, below the API limit of 300k
+EMBED_BATCH_TIMEOUT = 0.05  # seconds to wait for more requests before dispatching a batch
+
+_embedding_encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+def count_embedding_tokens(texts: List[str]) -> int:
+    """Count the tokens of texts as the embedding model sees them."""
+    return sum(len(tokens) for tokens in _embedding_encoding.encode_ordinary_batch(texts))
+
+embed_batcher = EmbedBatcher(
+    functools.partial(openai_embed, model=EMBEDDING_MODEL), count_embedding_tokens,
+    max_texts=EMBED_BATCH_MAX_TEXTS, max_tokens=EMBED_BATCH_MAX_TOKENS, timeout=EMBED_BATCH_TIMEOUT
+)
+
+
+def embedding_cache_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Build the Redis key of a cached embedding from the model name and the text hash."""
+    return f"{EMBEDDING_CACHE_PREFIX}:{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+# Most recently used embeddings keyed by a digest of the model name and text
+_local_embeddings: LRUCache = LRUCache(maxsize=EMBEDDING_LOCAL_CACHE_SIZE)
+
+def local_embedding_key(text: str, model: str = EMBEDDING_MODEL) -> bytes:
+    """Build the in-process cache key of an embedding from the model name and the text."""
+    return hashlib.blake2b(f"{model}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+
+async def cached_embed(texts: List[str]) -> np.ndarray:
+    """Embed texts with OpenAI, reusing embeddings cached in memory and in Redis.
+    
+    Texts are looked up in an in-process LRU cache first, then in Redis. Only the
+    texts found in neither are sent to the API, batched together with concurrent
+    requests.
+    
+    Args:
+        texts: The texts to embed.
+        
+    Returns:
+        Array of shape (len(texts), embedding_dim) with float32 embeddings.
+    """
+    local_keys = [local_embedding_key(text) for text in texts]
+    vectors = [_local_embeddings.get(key) for key in local_keys]
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    if misses:
+        computed = await redis_cached_embed([texts[i] for i in misses])
+        for i, vector in zip(misses, computed):
+            vectors[i] = vector
+            # Copied, a row view would keep its whole batch array alive in the cache
+            _local_embeddings[local_keys[i]] = vector.copy()
+    return np.vstack(vectors)
+
+
+async def redis_cached_embed(texts: List[str]) -> np.ndarray:
+    """Embed texts with OpenAI, reusing embeddings cached in Redis.
+    
+    Only the texts without a cached embedding are sent to the API, batched together
+    with concurrent requests. If Redis is unavailable, all texts are embedded directly.
+    
+    Args:
+        texts: The texts to embed.
+        
+    Returns:
+        Array of shape (len(texts), embedding_dim) with float32 embeddings.
+    """
+    redis = get_redis_client()
+    keys = [embedding_cache_key(text) for text in texts]
+    try:
+        cached = await redis.mget(keys)
+    except Exception as e:
+        logger.warning(f"Embedding cache unavailable: {str(e)}")
+        return np.asarray(await embed_batcher.embed(texts), dtype=np.float32)
+    
+    vectors = [None if value is None else np.frombuffer(value, dtype=np.float32) for value in cached]
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    if misses:
+        computed = np.asarray(await embed_batcher.embed([texts[i] for i in misses]), dtype=np.float32)
+        for i, vector in zip(misses, computed):
+            vectors[i] = vector
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for i, vector in zip(misses, computed):
+                    pipe.set(keys[i], vector.tobytes(), ex=EMBEDDING_CACHE_TTL)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to store embeddings in cache: {str(e)}")
+    
+    return np.vstack(vectors)
+
+
+# LightRAG needs the embedding dimension and token limit alongside the function
+cached_openai_embed = EmbeddingFunc(
+    embedding_dim=openai_embed.embedding_dim,
+    max_token_size=openai_embed.max_token_size,
+    func=cached_embed,
+)
+
 async def initialize_rag():
     rag = LightRAG(
         working_dir="data/",
         llm_model_func=gpt_4o_mini_complete,  # Use gpt_4o_mini_complete LLM model
-        embedding_func=openai_embed,
+        embedding_func=cached_openai_embed,  # OpenAI embeddings cached in Redis
         graph_storage="Neo4JStorage", #<-----------override KG default
         kv_storage="RedisKVStorage",
     )
@@ -64,6 +279,18 @@ async def initialize_rag():
     return rag
 
 
+_rag_singleton: Optional[LightRAG] = None
+_rag_lock = asyncio.Lock()
+
+async def get_rag() -> LightRAG:
+    """Return the shared LightRAG instance, initializing it on first use."""
+    global _rag_singleton
+    async with _rag_lock:
+        if _rag_singleton is None:
+            _rag_singleton = await initialize_rag()
+    return _rag_singleton
+
+
 @dataclass
 class RAGDeps:
     """Dependencies for the RAG agent."""
@@ -132,7 +359,7 @@ async def store_memory(context: RunContext[RAGDeps], messages: Union[List[Dict[s
         The result of the memory storage operation.
     """
     user_id = user_id or context.deps.user_id
-    result = await context.deps.mem0_client.add(messages, user_id=user_id)
+    result = await memory_writes.add(context.deps.mem0_client, messages, user_id=user_id)
     return result
 
 @agent.tool
@@ -148,7 +375,7 @@ async def retrieve_memory(context: RunContext[RAGDeps], query: str, user_id: Opt
         List of relevant memories.
     """
     user_id = user_id or context.deps.user_id
-    memories = await context.deps.mem0_client.search(query, user_id=user_id)
+    memories = await search_memories(context.deps.mem0_client, query, user_id=user_id)
     return memories
 
 async def run_rag_agent(question: str, user_id: str = "user_andrei") -> str:
@@ -162,7 +389,7 @@ async def run_rag_agent(question: str, user_id: str = "user_andrei") -> str:
         The agent's response.
     """
     # Create dependencies
-    rag = await initialize_rag()
+    rag = await get_rag()
     deps = RAGDeps(lightrag=rag, mem0_client=mem0_client, user_id=user_id)
     
     # Run the agent
@@ -171,18 +398,25 @@ async def run_rag_agent(question: str, user_id: str = "user_andrei") -> str:
     return result.output
 
 
+async def run_rag_agent_questions(questions: List[str]) -> List[str]:
+    """Answer several questions in turn, reusing the same RAG pipeline."""
+    return [await run_rag_agent(question) for question in questions]
+
+
 def main():
     """Main function to parse arguments and run the RAG agent."""
     parser = argparse.ArgumentParser(description="Run a Pydantic AI agent with RAG using Neo4j")
-    parser.add_argument("--question", help="The question to answer about")
+    parser.add_argument("--question", action="append", required=True,
+                        help="The question to answer about (repeat to ask several questions)")
     
     args = parser.parse_args()
     
-    # Run the agent
-    response = asyncio.run(run_rag_agent(args.question))
+    # Run the agent, all questions share one event loop and RAG pipeline
+    responses = asyncio.run(run_rag_agent_questions(args.question))
     
-    print("\nResponse:")
-    print(response)
+    for response in responses:
+        print("\nResponse:")
+        print(response)
 
 
 if __name__ == "__main__":
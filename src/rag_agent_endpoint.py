@@ -1,9 +1,11 @@
 from fastapi import FastAPI, HTTPException, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict
+from pydantic import BaseModel, TypeAdapter
+from cachetools import LRUCache
+from typing import List, Optional, Dict, Any, Tuple
 import asyncio
 import os
+import numpy as np
 from dotenv import load_dotenv
 from pydantic_ai.messages import (
     ModelMessage,
@@ -12,7 +14,8 @@ from pydantic_ai.messages import (
     UserPromptPart,
     TextPart
 )
-from rag_agent import agent, RAGDeps, initialize_rag, mem0_client
+from rag_agent import agent, RAGDeps, get_rag, mem0_client, get_redis_client, get_memory_version, cached_openai_embed
+from message_history import MAX_HISTORY_MESSAGES, trim_history, cache_namespace
 from contextlib import asynccontextmanager
 from starlette.websockets import WebSocketDisconnect
 
@@ -27,7 +30,7 @@ async def lifespan(app: FastAPI):
     # Initialize lightRAG dependencies and anything else to share across api requests
     global agent_deps
     try:
-        rag = await initialize_rag()
+        rag = await get_rag()
         agent_deps = RAGDeps(lightrag=rag, mem0_client=mem0_client, user_id="user_andrei")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to initialize RAG agent: {str(e)}")
@@ -56,8 +59,146 @@ class QueryResponse(BaseModel):
     response: str
     new_messages: List[ModelMessage]
 
+# Message history configuration
+HISTORY_CACHE_SIZE = 1024  # sessions kept in memory, older ones are reloaded from Redis
+HISTORY_KEY_PREFIX = "history"
+HISTORY_STORED_MESSAGES = 4 * MAX_HISTORY_MESSAGES  # most recent messages kept per session in memory and in Redis
+HISTORY_TTL = 30 * 24 * 60 * 60  # seconds the history of an idle session is kept in Redis
+
 # initialize message storage
-message_histories: Dict[str, List[ModelMessage]] = {}  # Store message histories by session ID
+message_histories: LRUCache = LRUCache(maxsize=HISTORY_CACHE_SIZE)  # Store message histories by session ID
+message_adapter = TypeAdapter(ModelMessage)
+
+async def get_history(session_id: str) -> List[ModelMessage]:
+    """Get the message history of a session, loading its most recent messages from Redis if not in memory."""
+    history = message_histories.get(session_id)
+    if history is None:
+        try:
+            stored = await get_redis_client().lrange(f"{HISTORY_KEY_PREFIX}:{session_id}", -HISTORY_STORED_MESSAGES, -1)
+            history = [message_adapter.validate_json(message) for message in stored]
+        except Exception as e:
+            print(f"Failed to load message history for {session_id}: {str(e)}")
+            history = []
+        message_histories[session_id] = history
+    return history
+
+async def append_history(session_id: str, new_messages: List[ModelMessage]) -> None:
+    """Append messages to the session history in memory and in Redis.
+    
+    Both keep only the last HISTORY_STORED_MESSAGES messages, well above what trim_history
+    passes to the agent, so the trimmed history can still start at a user prompt.
+    """
+    if not new_messages:
+        return
+    history = await get_history(session_id)
+    history.extend(new_messages)
+    # Trimmed in place, callers may hold the list
+    del history[:-HISTORY_STORED_MESSAGES]
+    key = f"{HISTORY_KEY_PREFIX}:{session_id}"
+    try:
+        async with get_redis_client().pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(message_adapter.dump_json(message) for message in new_messages))
+            pipe.ltrim(key, -HISTORY_STORED_MESSAGES, -1)
+            pipe.expire(key, HISTORY_TTL)
+            await pipe.execute()
+    except Exception as e:
+        print(f"Failed to persist message history for {session_id}: {str(e)}")
+
+# Semantic response cache configuration
+RESPONSE_CACHE_PREFIX = "response_cache"
+RESPONSE_CACHE_DISTANCE_THRESHOLD = 0.1  # maximum cosine distance to reuse a cached response
+RESPONSE_CACHE_MAX_ENTRIES = 256  # per namespace
+RESPONSE_CACHE_TTL = 24 * 60 * 60  # seconds
+RESPONSE_CACHE_CHUNK_SIZE = 64  # characters per streamed chunk when replaying a cached response
+
+class SemanticResponseCache:
+    """Redis-backed cache of agent responses looked up by question embedding similarity.
+    
+    Entries are kept per namespace as two parallel Redis lists (embeddings and responses),
+    newest first and capped at max_entries, so a lookup is one round-trip plus a
+    matrix-vector product.
+    """
+    
+    def __init__(self, prefix: str = RESPONSE_CACHE_PREFIX,
+                 distance_threshold: float = RESPONSE_CACHE_DISTANCE_THRESHOLD,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl: int = RESPONSE_CACHE_TTL):
+        self.prefix = prefix
+        self.distance_threshold = distance_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+    
+    def _keys(self, namespace: str) -> Tuple[str, str]:
+        return f"{self.prefix}:{namespace}:embeddings", f"{self.prefix}:{namespace}:responses"
+    
+    async def check(self, namespace: str, question: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Look up a cached response for a semantically similar question.
+        
+        Returns:
+            Tuple of the cached response (None on a miss) and the normalized question
+            embedding to pass to store() (None if the cache is unavailable).
+        """
+        try:
+            embedding = np.asarray((await cached_openai_embed([question]))[0], dtype=np.float32)
+            embedding /= np.linalg.norm(embedding) or 1.0
+            
+            embeddings_key, responses_key = self._keys(namespace)
+            async with get_redis_client().pipeline(transaction=True) as pipe:
+                pipe.lrange(embeddings_key, 0, -1)
+                pipe.lrange(responses_key, 0, -1)
+                cached_embeddings, cached_responses = await pipe.execute()
+        except Exception as e:
+            print(f"Response cache unavailable: {str(e)}")
+            return None, None
+        
+        if not cached_embeddings or len(cached_embeddings) != len(cached_responses):
+            return None, embedding
+        
+        matrix = np.frombuffer(b"".join(cached_embeddings), dtype=np.float32).reshape(len(cached_embeddings), -1)
+        similarities = matrix @ embedding
+        best = int(np.argmax(similarities))
+        if 1 - similarities[best] <= self.distance_threshold:
+            return cached_responses[best].decode("utf-8"), embedding
+        return None, embedding
+    
+    async def store(self, namespace: str, embedding: Optional[np.ndarray], response: str) -> None:
+        """Store a response under the question embedding returned by check()."""
+        if embedding is None or not response:
+            return
+        embeddings_key, responses_key = self._keys(namespace)
+        try:
+            async with get_redis_client().pipeline(transaction=True) as pipe:
+                pipe.lpush(embeddings_key, embedding.tobytes())
+                pipe.lpush(responses_key, response)
+                for key in (embeddings_key, responses_key):
+                    pipe.ltrim(key, 0, self.max_entries - 1)
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            print(f"Failed to store response in cache: {str(e)}")
+
+response_cache = SemanticResponseCache()
+
+def cached_turn(question: str, response: str) -> List[ModelMessage]:
+    """Build the messages of a turn answered from the response cache."""
+    return [
+        ModelRequest(parts=[UserPromptPart(content=question)]),
+        ModelResponse(parts=[TextPart(content=response)]),
+    ]
+
+def serialize_messages(messages: List[ModelMessage]) -> List[Dict[str, Any]]:
+    """Convert model messages to the pure JSON format sent over the WebSocket."""
+    return [
+        {
+            "type": msg.__class__.__name__,
+            "parts": [
+                {
+                    "part_kind": part.part_kind,
+                    "content": getattr(part, "content", str(part))
+                } for part in msg.parts
+            ]
+        } for msg in messages
+    ]
 
 @app.post("/query", response_model=QueryResponse)
 async def query_agent(request: QueryRequest, session_id: str = "default"):
@@ -66,15 +207,23 @@ async def query_agent(request: QueryRequest, session_id: str = "default"):
     """
     try:
         # Get or initialize message history for this session
-        if session_id not in message_histories:
-            message_histories[session_id] = []
+        history = await get_history(session_id)
+        context = trim_history(history)
+        
+        # Answer from the semantic cache if a similar question was already answered in the same context
+        namespace = cache_namespace(agent_deps.user_id, context, await get_memory_version(agent_deps.user_id))
+        cached_response, embedding = await response_cache.check(namespace, request.question)
+        if cached_response is not None:
+            new_messages = cached_turn(request.question, cached_response)
+            await append_history(session_id, new_messages)
+            return QueryResponse(response=cached_response, new_messages=new_messages)
         
         # Run the agent with streaming 
         # FIXME: we may not need to stream the response, we can just return the full response
         async with agent.run_stream(
             request.question,
             deps=agent_deps,
-            message_history=message_histories[session_id]
+            message_history=context
         ) as result:
             full_response = ""
             async for chunk in result.stream_text(delta=True):
@@ -82,7 +231,8 @@ async def query_agent(request: QueryRequest, session_id: str = "default"):
 
             # Update message history
             new_messages = result.new_messages()
-            message_histories[session_id].extend(new_messages)
+            await append_history(session_id, new_messages)
+            await response_cache.store(namespace, embedding, full_response)
 
             return QueryResponse(
                 response=full_response,
@@ -96,38 +246,51 @@ async def get_message_history(session_id: str = "default"):
     """
     Get the message history for a specific session.
     """
-    return message_histories.get(session_id, [])
+    return await get_history(session_id)
 
 async def handle_agent_stream(websocket: WebSocket, question: str, session_id: str) -> None:
     """Handle the agent streaming process."""
+    history = await get_history(session_id)
+    context = trim_history(history)
+    
+    # Replay a cached response in chunks so clients see the same message flow
+    namespace = cache_namespace(agent_deps.user_id, context, await get_memory_version(agent_deps.user_id))
+    cached_response, embedding = await response_cache.check(namespace, question)
+    if cached_response is not None:
+        for start in range(0, len(cached_response), RESPONSE_CACHE_CHUNK_SIZE):
+            await websocket.send_json({
+                "type": "chunk",
+                "content": cached_response[start:start + RESPONSE_CACHE_CHUNK_SIZE]
+            })
+        new_messages = cached_turn(question, cached_response)
+        await append_history(session_id, new_messages)
+        await websocket.send_json({
+            "type": "complete",
+            "new_messages": serialize_messages(new_messages)
+        })
+        return
+    
     # here we are streaming the response to the client
     async with agent.run_stream(
         question,
         deps=agent_deps,
-        message_history=message_histories[session_id]
+        message_history=context
     ) as result:
         # Stream text chunks
+        full_response = ""
         async for chunk in result.stream_text(delta=True):
+            full_response += chunk
             await websocket.send_json({
                 "type": "chunk",
                 "content": chunk
             })
         
         # Send completion message in pure JSON format
-        new_messages = [
-            {
-                "type": msg.__class__.__name__,
-                "parts": [
-                    {
-                        "part_kind": part.part_kind,
-                        "content": getattr(part, "content", str(part))
-                    } for part in msg.parts
-                ]
-            } for msg in result.new_messages()
-        ]
+        new_messages = serialize_messages(result.new_messages())
         
-        # Update message history in pure JSON format
-        message_histories[session_id].extend(result.new_messages())
+        # Update message history
+        await append_history(session_id, result.new_messages())
+        await response_cache.store(namespace, embedding, full_response)
         await websocket.send_json({
             "type": "complete",
             "new_messages": new_messages
@@ -139,9 +302,8 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for streaming agent responses."""
     await websocket.accept()
     
-    # Initialize session history if needed
-    if session_id not in message_histories:
-        message_histories[session_id] = []
+    # Load session history if needed
+    await get_history(session_id)
     
     try:
         while True:
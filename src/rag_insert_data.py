@@ -7,7 +7,7 @@ from lightrag.llm.openai import gpt_4o_mini_complete, openai_embed
 from lightrag.kg.shared_storage import initialize_pipeline_status
 from lightrag.utils import setup_logger
 from dotenv import load_dotenv
-from rag_agent import initialize_rag
+from rag_agent import get_rag
 
 # Load environment variables
 load_dotenv(r'.env')
@@ -15,11 +15,24 @@ load_dotenv(r'.env')
 # Setup logger
 setup_logger("lightrag", level="INFO")
 
+# Maximum number of files read at the same time during directory ingestion
+MAX_CONCURRENT_READS = 8
+
+async def read_text_file(file_path: Path) -> Optional[str]:
+    """Read a single text file, returning None if it cannot be read."""
+    try:
+        # Read in a worker thread so the event loop keeps serving other tasks
+        return await asyncio.to_thread(Path(file_path).read_text, encoding='utf-8')
+    except Exception as e:
+        print(f"Error reading {file_path}: {str(e)}")
+        return None
+
 async def process_text_file(file_path: Path, rag: LightRAG) -> None:
     """Process a single text file and add it to the RAG database."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = await read_text_file(file_path)
+        if content is None:
+            return
         
         # Add the document to RAG
         await rag.ainsert(content)
@@ -31,7 +44,7 @@ async def ingest_file(file_path: str) -> None:
     """Ingest a single text file into LightRAG."""
     try:
         # Initialize RAG
-        rag = await initialize_rag()
+        rag = await get_rag()
         
         # Process the file
         await process_text_file(Path(file_path), rag)
@@ -43,7 +56,7 @@ async def ingest_files(directory: str, file_pattern: str = "*.txt") -> None:
     """Ingest all matching text files from a directory into LightRAG."""
     try:
         # Initialize RAG
-        rag = await initialize_rag()
+        rag = await get_rag()
         
         # Get all matching files
         directory_path = Path(directory)
@@ -53,11 +66,24 @@ async def ingest_files(directory: str, file_pattern: str = "*.txt") -> None:
             print(f"No {file_pattern} files found in {directory}")
             return
         
-        # Process files concurrently
-        tasks = [process_text_file(file, rag) for file in files]
-        await asyncio.gather(*tasks)
+        # Read files concurrently, with a cap on the number of open files
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_READS)
+        
+        async def read_limited(file: Path) -> Optional[str]:
+            async with semaphore:
+                return await read_text_file(file)
+        
+        contents = await asyncio.gather(*(read_limited(file) for file in files))
+        documents = [content for content in contents if content is not None]
+        
+        if not documents:
+            print(f"No readable {file_pattern} files found in {directory}")
+            return
+        
+        # Insert all documents in one batch so LightRAG can chunk and embed them together
+        await rag.ainsert(documents)
         
-        print(f"Successfully processed {len(files)} files")
+        print(f"Successfully processed {len(documents)} of {len(files)} files")
         
     except Exception as e:
         print(f"An error occurred: {str(e)}")
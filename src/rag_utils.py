@@ -1,17 +1,39 @@
 """Utility functions for RAG operations."""
 
 import os
-from typing import List, Dict, Any, Optional
+import atexit
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 from neo4j import GraphDatabase, Driver
 from dotenv import load_dotenv
 from lightrag import LightRAG
-from sklearn.metrics.pairwise import pairwise_distances
+from lightrag.base import BaseGraphStorage
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import pdist, squareform
+from sklearn.metrics.pairwise import pairwise_distances, PAIRWISE_BOOLEAN_FUNCTIONS
+
+try:
+    import faiss  # optional: threshold search without materializing the similarity matrix
+except ImportError:
+    faiss = None
+
+try:
+    from numba import njit, prange  # optional: native loop for extracting similar pairs
+except ImportError:
+    njit = None
 
 # Load environment variables
 load_dotenv(r'../.env')
 
+# Shared Neo4j drivers keyed by (uri, database), each one owns a connection pool
+_drivers: Dict[Tuple[str, str], Driver] = {}
+
 def get_neo4j_driver(database: str = "chunk-entity-relation") -> Driver:
-    """Create and return a Neo4j database driver instance.
+    """Return the shared Neo4j database driver instance for a database.
+    
+    The driver is created on first use and reused afterwards, so its pooled connections
+    stay warm across calls. All drivers are closed when the interpreter exits.
     
     Args:
         database (str): Name of the Neo4j database to connect to. Defaults to "chunk-entity-relation".
@@ -19,14 +41,38 @@ def get_neo4j_driver(database: str = "chunk-entity-relation") -> Driver:
     Returns:
         Driver: Neo4j database driver instance
     """
-    driver = GraphDatabase.driver(
-        os.getenv("NEO4J_URI", "bolt://localhost:7687"),
-        auth=(os.getenv("NEO4J_USERNAME", "neo4j"), os.getenv("NEO4J_PASSWORD", "password")),
-        database=database
-    )
+    uri = os.getenv("NEO4J_URI", "bolt://localhost:7687")
+    driver = _drivers.get((uri, database))
+    if driver is None:
+        driver = GraphDatabase.driver(
+            uri,
+            auth=(os.getenv("NEO4J_USERNAME", "neo4j"), os.getenv("NEO4J_PASSWORD", "password")),
+            database=database,
+            max_connection_pool_size=int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE") or 100),
+            connection_acquisition_timeout=float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT") or 60.0)
+        )
+        _drivers[(uri, database)] = driver
     return driver
 
 
+def close_neo4j_drivers() -> None:
+    """Close all shared Neo4j drivers."""
+    while _drivers:
+        _, driver = _drivers.popitem()
+        driver.close()
+
+atexit.register(close_neo4j_drivers)
+
+
+# Query to get all nodes with their properties
+ALL_ENTITIES_QUERY = """
+MATCH (n)
+RETURN n.entity_id as entity_id,
+       n.entity_type as entity_type,
+       n.description as description
+"""
+
+
 def get_all_entities(driver: Driver) -> List[Dict[str, Any]]:
     """Get all entities from Neo4j database as a list of dictionaries.
     
@@ -38,33 +84,144 @@ def get_all_entities(driver: Driver) -> List[Dict[str, Any]]:
     """
     try:
         with driver.session() as session:
-            # Query to get all nodes with their properties
-            query = """
-            MATCH (n)
-            RETURN n.entity_id as entity_id,
-                   n.entity_type as entity_type,
-                   n.description as description
-            """
-            
-            result = session.run(query)
-            
-            # Convert results to list of dictionaries
-            entities = []
-            for record in result:
-                entity = {
-                    "entity_id": record["entity_id"],
-                    "entity_type": record["entity_type"],
-                    "description": record["description"]
-                }
-                entities.append(entity)
-            
-            return entities
+            # Convert results to list of dictionaries in one pass
+            return session.run(ALL_ENTITIES_QUERY).data()
             
     except Exception as e:
         print(f"Error getting entities: {str(e)}")
         return []
 
 
+def iter_all_entities(driver: Driver) -> Iterator[Dict[str, Any]]:
+    """Yield all entities from Neo4j one at a time instead of materializing them.
+    
+    Args:
+        driver: Neo4j database driver instance
+        
+    Yields:
+        Dict[str, Any]: Entity dictionary containing entity_id, entity_type, and description
+    """
+    with driver.session() as session:
+        for record in session.run(ALL_ENTITIES_QUERY):
+            yield record.data()
+
+
+def get_all_entities_df(driver: Driver) -> pd.DataFrame:
+    """Get all entities from Neo4j as a pandas DataFrame for analytic processing.
+    
+    Args:
+        driver: Neo4j database driver instance
+        
+    Returns:
+        pd.DataFrame: One row per entity with entity_id, entity_type and description columns
+    """
+    with driver.session() as session:
+        return session.run(ALL_ENTITIES_QUERY).to_df()
+
+
+async def get_entity_types(rag, entity_names: List[str]) -> Dict[str, str]:
+    """Get the entity_type of many entities through the LightRAG graph storage.
+    
+    Uses the storage's batched node lookup where the backend implements one (for Neo4j a
+    single indexed UNWIND query on the configured database). The default get_nodes_batch of
+    BaseGraphStorage awaits get_node one name at a time, so other backends use concurrent
+    get_node calls instead.
+    
+    Args:
+        rag: LightRAG instance
+        entity_names: List of entity ids to look up
+        
+    Returns:
+        Dict[str, str]: Mapping of entity id to entity type ('UNKNOWN' if the node has no type)
+    """
+    graph = rag.chunk_entity_relation_graph
+    batch_lookup = getattr(type(graph), 'get_nodes_batch', None)
+    if batch_lookup is None or batch_lookup is getattr(BaseGraphStorage, 'get_nodes_batch', None):
+        return await get_entity_types_from_graph(rag, entity_names)
+    nodes = await graph.get_nodes_batch(entity_names)
+    return {name: (node or {}).get('entity_type') or 'UNKNOWN' for name, node in nodes.items()}
+
+
+async def get_entity_types_from_graph(rag, entity_names: List[str]) -> Dict[str, str]:
+    """Get the entity_type of many entities through the LightRAG graph storage.
+    
+    Works with any graph storage backend; the get_node calls are issued concurrently.
+    Used by get_entity_types for backends without a batched node lookup.
+    
+    Args:
+        rag: LightRAG instance
+        entity_names: List of entity ids to look up
+        
+    Returns:
+        Dict[str, str]: Mapping of entity id to entity type ('UNKNOWN' if the node has no type)
+    """
+    nodes = await asyncio.gather(*(rag.chunk_entity_relation_graph.get_node(name) for name in entity_names))
+    return {
+        name: (node or {}).get('entity_type') or 'UNKNOWN'
+        for name, node in zip(entity_names, nodes)
+    }
+
+
+async def get_vdb_storage(rag, name: str = "entities_vdb") -> Dict[str, Any]:
+    """Get the client storage of a LightRAG vector store.
+    
+    client_storage returns the live storage of the store's current client without copying
+    it, so it is not memoized; a client reloaded after writes from another process is
+    picked up on the next call.
+    
+    Args:
+        rag: LightRAG instance
+        name (str): Attribute name of the vector store on rag, e.g. "entities_vdb" or "chunks_vdb"
+        
+    Returns:
+        Dict[str, Any]: The NanoVectorDB storage with 'data' and 'matrix'
+    """
+    return await getattr(rag, name).client_storage
+
+
+async def get_entity_labels(rag, refresh: bool = False) -> List[str]:
+    """Get all entity labels from the graph storage, memoized on the rag object.
+    
+    The cached labels are tied to the current entities_vdb matrix, which the vector
+    store replaces whenever entities are inserted, merged or deleted.
+    
+    Args:
+        rag: LightRAG instance
+        refresh (bool): Query the graph even if the labels are cached
+        
+    Returns:
+        List[str]: All entity labels
+    """
+    matrix = (await get_vdb_storage(rag, "entities_vdb"))['matrix']
+    cached = getattr(rag, '_labels_cache', None)
+    if refresh or cached is None or cached[0] is not matrix:
+        labels = await rag.chunk_entity_relation_graph.get_all_labels()
+        rag._labels_cache = cached = (matrix, labels)
+    return cached[1]
+
+
+def vdb_frame(storage: Dict[str, Any], key: str) -> pd.DataFrame:
+    """Build a DataFrame of a vector store's metadata indexed by one of its fields.
+    
+    Rows keep the order of storage['matrix'], so frame.index.get_loc(value) is also the
+    row of the corresponding embedding.
+    
+    Args:
+        storage: NanoVectorDB storage with 'data' and 'matrix'
+        key (str): Field to index by, e.g. 'entity_name' or '__id__'
+        
+    Returns:
+        pd.DataFrame: One row per vector with all metadata fields as columns
+    """
+    return pd.DataFrame(storage['data']).set_index(key, drop=False)
+
+
+def invalidate_rag_caches(rag) -> None:
+    """Drop the label cache kept on the rag object."""
+    if hasattr(rag, '_labels_cache'):
+        del rag._labels_cache
+
+
 async def get_embeddings_by_entity_type(rag):
     """Get embeddings from entities_vdb matrix grouped by entity_type.
     
@@ -74,16 +231,20 @@ async def get_embeddings_by_entity_type(rag):
             - embeddings: numpy array of corresponding embeddings
             - indices: list of original indices from entities_vdb
     """
-    entities_vdb = await rag.entities_vdb.client_storage
-    entities_list = await rag.chunk_entity_relation_graph.get_all_labels()
+    entities_vdb = await get_vdb_storage(rag, "entities_vdb")
+    entities_list = await get_entity_labels(rag)
+    labels_set = frozenset(entities_list)
+    
+    # Look up the types of all known entities with one batched query
+    names = [ent['entity_name'] for ent in entities_vdb['data'] if ent['entity_name'] in labels_set]
+    types_by_name = await get_entity_types(rag, names)
     
     # First, get all entity types and their indices
     entity_types = {}
     for i, ent in enumerate(entities_vdb['data']):
         entity_name = ent['entity_name']
-        if entity_name in entities_list:
-            node_data = await rag.chunk_entity_relation_graph.get_node(entity_name)
-            entity_type = node_data.get('entity_type', 'UNKNOWN')
+        if entity_name in types_by_name:
+            entity_type = types_by_name[entity_name]
             if entity_type not in entity_types:
                 entity_types[entity_type] = {
                     'entity_names': [],
@@ -105,8 +266,131 @@ async def get_embeddings_by_entity_type(rag):
     return embeddings_by_type
 
 
-async def compute_similarity_metrics(embeddings_by_type: Dict[str, Dict[str, Any]], metric='cosine', threshold=0.8):
-    """Compute similarity metrics between embeddings within each entity type group using scikit-learn.
+# scikit-learn metric names that scipy's pdist knows under another name
+_PDIST_METRICS = {
+    'manhattan': 'cityblock',
+    'l1': 'cityblock',
+    'l2': 'euclidean',
+}
+
+
+def _condensed_to_pairs(condensed_indices: np.ndarray, n: int):
+    """Map indices into pdist's condensed distance vector back to their (rows, cols).
+    
+    Only the given indices are mapped, so no N(N-1)/2 index table is materialized.
+    """
+    i = np.arange(max(n - 1, 0))
+    row_starts = i * (2 * n - i - 1) // 2  # condensed index of (i, i + 1)
+    rows = np.searchsorted(row_starts, condensed_indices, side='right') - 1
+    cols = condensed_indices - row_starts[rows] + rows + 1
+    return rows, cols
+
+
+def _normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    """Return a float32 copy of the embeddings with each row scaled to unit L2 norm.
+    
+    Zero rows stay zero, so they get similarity 0 with everything, as in scikit-learn.
+    """
+    normalized = np.array(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(normalized, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    normalized /= norms
+    return normalized
+
+
+def _distance_to_similarity(distances: np.ndarray, metric: str) -> np.ndarray:
+    """Convert distances to similarities for the given metric."""
+    if metric in ['cosine', 'correlation', 'jaccard']:
+        return 1 - distances
+    return 1 / (1 + distances)  # For distance metrics like euclidean, manhattan
+
+
+def _collect_pairs_numpy(similarities: np.ndarray, threshold: float):
+    """Collect upper-triangle pairs at or above threshold with a NumPy boolean mask."""
+    rows, cols = np.nonzero(np.triu(similarities >= threshold, k=1))
+    return rows, cols, similarities[rows, cols]
+
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _collect_pairs_numba(similarities, threshold):
+        """Collect upper-triangle pairs at or above threshold in two parallel passes.
+        
+        The first pass counts matches per row, the second writes them at per-row
+        offsets, so no triangular index table has to be materialized.
+        """
+        n = similarities.shape[0]
+        counts = np.zeros(n, dtype=np.int64)
+        for i in prange(n):
+            count = 0
+            for j in range(i + 1, n):
+                if similarities[i, j] >= threshold:
+                    count += 1
+            counts[i] = count
+        
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        rows = np.empty(offsets[n], dtype=np.int64)
+        cols = np.empty(offsets[n], dtype=np.int64)
+        scores = np.empty(offsets[n], dtype=similarities.dtype)
+        for i in prange(n):
+            k = offsets[i]
+            for j in range(i + 1, n):
+                if similarities[i, j] >= threshold:
+                    rows[k] = i
+                    cols[k] = j
+                    scores[k] = similarities[i, j]
+                    k += 1
+        return rows, cols, scores
+
+
+def _collect_pairs(similarities: np.ndarray, threshold: float):
+    """Find all upper-triangle pairs of a similarity matrix at or above threshold.
+    
+    Uses a Numba-compiled loop when numba is installed and a NumPy mask otherwise.
+    
+    Args:
+        similarities: Square similarity matrix
+        threshold (float): Minimum similarity of a pair
+        
+    Returns:
+        tuple: Arrays (rows, cols, scores) in row-major order with rows < cols
+    """
+    if njit is not None:
+        return _collect_pairs_numba(np.ascontiguousarray(similarities), threshold)
+    return _collect_pairs_numpy(similarities, threshold)
+
+
+def _range_search_pairs(normalized: np.ndarray, threshold: float):
+    """Find all upper-triangle pairs with inner product above threshold using a FAISS flat index.
+    
+    Args:
+        normalized: L2-normalized embeddings, one row per entity
+        threshold (float): Minimum inner product (cosine similarity) of a pair
+        
+    Returns:
+        tuple: Arrays (rows, cols, scores) for pairs with rows < cols
+    """
+    vectors = np.ascontiguousarray(normalized, dtype=np.float32)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    lims, scores, cols = index.range_search(vectors, threshold)
+    
+    # lims[i]:lims[i+1] delimits the neighbors of query i
+    rows = np.repeat(np.arange(len(vectors)), np.diff(lims))
+    upper = cols > rows
+    return rows[upper], cols[upper], scores[upper]
+
+
+async def compute_similarity_metrics(embeddings_by_type: Dict[str, Dict[str, Any]], metric='cosine', threshold=0.8,
+                                     return_similarities: bool = True):
+    """Compute similarity metrics between embeddings within each entity type group.
+    
+    Cosine similarity is computed with a single matrix product on L2-normalized embeddings.
+    Other metrics use scipy's pdist, which only computes the upper triangle, and fall back
+    to scikit-learn pairwise distances for metrics scipy does not know. When the full similarity
+    matrix is not requested and FAISS is installed, cosine pairs are found with a range
+    search instead, so memory grows with the number of pairs rather than N².
     
     Args:
         embeddings_by_type: Dictionary with entity types as keys and values containing:
@@ -119,13 +403,14 @@ async def compute_similarity_metrics(embeddings_by_type: Dict[str, Dict[str, Any
             - 'manhattan': Manhattan distance (converted to similarity)
             - 'correlation': Correlation coefficient
             - 'jaccard': Jaccard similarity
-            - Any other metric supported by sklearn.metrics.pairwise_distances
+            - Any other metric supported by scipy.spatial.distance.pdist or sklearn.metrics.pairwise_distances
         threshold (float): Threshold for similarity score (0 to 1)
+        return_similarities (bool): Whether to include the full similarity matrix in the results
         
     Returns:
         dict: Dictionary with entity types as keys and values containing:
             - pairs: List of tuples (entity1, entity2, similarity_score) for pairs exceeding threshold
-            - similarities: Full similarity matrix as numpy array
+            - similarities: Full similarity matrix as numpy array (None if return_similarities is False)
             - entity_names: List of entity names in the same order as the similarity matrix
             - metric: The metric used
             - threshold: The threshold used
@@ -135,31 +420,53 @@ async def compute_similarity_metrics(embeddings_by_type: Dict[str, Dict[str, Any
     for entity_type, data in embeddings_by_type.items():
         embeddings = data['embeddings']
         entity_names = data['entity_names']
-        
-        # Compute pairwise distances
-        distances = pairwise_distances(embeddings, metric=metric)
-        
-        # Convert distances to similarities
-        if metric in ['cosine', 'correlation', 'jaccard']:
-            similarities = 1 - distances
-        else:  # For distance metrics like euclidean, manhattan
-            similarities = 1 / (1 + distances)
-        
-        # Get pairs exceeding threshold (excluding self-similarities)
-        pairs = []
-        n = len(entity_names)
-        for i in range(n):
-            for j in range(i+1, n):  # Only compute upper triangle to avoid duplicates
-                similarity = similarities[i, j]
-                if similarity >= threshold:
-                    pairs.append((entity_names[i], entity_names[j], similarity))
-        
+        similarities = None
+        rows = None
+
+        if len(entity_names) == 0:
+            # pdist and pairwise_distances reject empty inputs, there is nothing to compare
+            similarities = np.zeros((0, 0), dtype=np.float32)
+            rows = cols = np.zeros(0, dtype=np.int64)
+            scores = np.zeros(0, dtype=np.float32)
+        elif metric == 'cosine':
+            # Cosine similarity on L2-normalized vectors is a single matrix product; normalizing
+            # is O(N·d) next to the O(N²·d) product, so any input is accepted
+            normalized = _normalize_rows(embeddings)
+            if faiss is not None and not return_similarities:
+                rows, cols, scores = _range_search_pairs(normalized, threshold)
+            else:
+                similarities = normalized @ normalized.T
+        else:
+            # scikit-learn compares boolean metrics (jaccard, dice, ...) on booleans, pdist on raw values
+            if metric in PAIRWISE_BOOLEAN_FUNCTIONS:
+                embeddings = np.asarray(embeddings, dtype=bool)
+            try:
+                # Condensed distances of the upper triangle only
+                condensed = pdist(embeddings, metric=_PDIST_METRICS.get(metric, metric))
+            except ValueError:
+                # Metric only known to scikit-learn, compute the full distance matrix
+                distances = pairwise_distances(embeddings, metric=metric, n_jobs=-1)
+                similarities = _distance_to_similarity(distances, metric)
+            else:
+                condensed_similarities = _distance_to_similarity(condensed, metric)
+                matches = np.flatnonzero(condensed_similarities >= threshold)
+                rows, cols = _condensed_to_pairs(matches, len(entity_names))
+                scores = condensed_similarities[matches]
+                if return_similarities:
+                    similarities = _distance_to_similarity(squareform(condensed), metric)
+    
+        if rows is None and similarities is not None:
+            # Get pairs exceeding threshold from the upper triangle (excluding self-similarities)
+            rows, cols, scores = _collect_pairs(similarities, threshold)
+    
         # Sort pairs by similarity score in descending order
-        pairs.sort(key=lambda x: x[2], reverse=True)
-        
+        order = np.argsort(-scores, kind='stable')
+        names = np.asarray(entity_names, dtype=object)
+        pairs = list(zip(names[rows[order]], names[cols[order]], scores[order].tolist()))
+    
         results[entity_type] = {
             'pairs': pairs,
-            'similarities': similarities,  # Full similarity matrix
+            'similarities': similarities if return_similarities else None,  # Full similarity matrix
             'entity_names': entity_names,  # Entity names in same order as matrix
             'metric': metric,
             'threshold': threshold
@@ -167,9 +474,49 @@ async def compute_similarity_metrics(embeddings_by_type: Dict[str, Dict[str, Any
     
     return results
 
+
+def group_merge_components(pairs: List[Tuple[str, str]]) -> List[List[str]]:
+    """Group entity pairs into connected components with a union-find.
+    
+    Args:
+        pairs: List of (source_entity, target_entity) tuples, strongest first
+        
+    Returns:
+        List[List[str]]: Components in order of first appearance; the first entity of
+            each component is the target of its strongest pair and serves as merge target
+    """
+    parent: Dict[str, str] = {}
+    
+    def find(entity: str) -> str:
+        parent.setdefault(entity, entity)
+        while parent[entity] != entity:
+            parent[entity] = parent[parent[entity]]  # path halving
+            entity = parent[entity]
+        return entity
+    
+    for source_entity, target_entity in pairs:
+        source_root, target_root = find(source_entity), find(target_entity)
+        if source_root != target_root:
+            parent[source_root] = target_root
+    
+    # Collect members by root, keeping the order entities first appear in (targets first)
+    components: Dict[str, List[str]] = {}
+    seen = set()
+    for source_entity, target_entity in pairs:
+        for entity in (target_entity, source_entity):
+            if entity not in seen:
+                seen.add(entity)
+                components.setdefault(find(entity), []).append(entity)
+    return list(components.values())
+
+
 async def merge_similar_entities(rag: LightRAG, similarity_results: Dict[str, Dict[str, Any]], merge_threshold: float = 0.9) -> None:
     """Merge similar entities based on similarity metrics results.
     
+    Pairs above the threshold are grouped into connected components, so chains like
+    A~B, B~C are merged into a single target with one amerge_entities call. Components
+    are merged one after another, as amerge_entities holds LightRAG's graph lock.
+    
     Args:
         rag: LightRAG instance
         similarity_results: Results from compute_similarity_metrics function
@@ -182,12 +529,13 @@ async def merge_similar_entities(rag: LightRAG, similarity_results: Dict[str, Di
         # Get pairs that exceed the merge threshold
         merge_pairs = [(pair[0], pair[1]) for pair in data['pairs'] if pair[2] >= merge_threshold]
         
-        # Process each pair
-        for source_entity, target_entity in merge_pairs:
+        # One merge per group of transitively similar entities
+        for component in group_merge_components(merge_pairs):
+            target_entity, source_entities = component[0], component[1:]
             try:
                 # Merge entities using LightRAG's amerge_entities
                 await rag.amerge_entities(
-                    source_entities=[source_entity],
+                    source_entities=source_entities,
                     target_entity=target_entity,
                     merge_strategy={
                         "description": "concatenate",  # Combine descriptions
@@ -197,6 +545,9 @@ async def merge_similar_entities(rag: LightRAG, similarity_results: Dict[str, Di
                         "entity_type": entity_type,
                     }
                 )
-                print(f"Merged {source_entity} into {target_entity}")
+                print(f"Merged {', '.join(source_entities)} into {target_entity}")
             except Exception as e:
-                print(f"Error merging {source_entity} into {target_entity}: {str(e)}")
\ No newline at end of file
+                print(f"Error merging {', '.join(source_entities)} into {target_entity}: {str(e)}")
+    
+    # The graph and vector stores changed, cached views of them are stale now
+    invalidate_rag_caches(rag)
@@ -2,23 +2,50 @@ from dotenv import load_dotenv
 import streamlit as st
 import asyncio
 import os
-import json
+import orjson
+import msgspec
+import time
 import websockets
-import asyncio
-from typing import List, Dict, AsyncGenerator
-import nest_asyncio
-
-
+from websockets.protocol import State
+from typing import List, Dict, AsyncGenerator, Union
 
-load_dotenv(r'.env')
 
 # API Configuration
 WS_URL = "ws://localhost:8001/ws"
 HTTP_URL = "http://localhost:8001"
 SESSION_ID = "streamlit_session"
+RENDER_INTERVAL = 0.05  # minimum seconds between UI updates while streaming
+RENDER_MIN_GROWTH = 8  # characters the response must grow by before an update is worth drawing
+RENDER_MAX_PENDING = 128  # characters after which an update is drawn without waiting for RENDER_INTERVAL
+WS_MAX_FRAME_SIZE = 2**20  # bytes, bounds the size of the complete frame carrying the new messages
+
+# Chat history rendering
+HISTORY_WINDOW = 30  # messages shown by default, and added per "Show earlier" click
+
+# Streaming cursor rendered once as its own element and animated by the browser
+CURSOR_HTML = """
+<style>
+@keyframes blink { 50% { opacity: 0; } }
+.blink { animation: blink 1s step-start infinite; }
+</style>
+<span class="blink">▌</span>
+"""
+
+
+@st.cache_resource
+def _load_env():
+    """Load the .env file once per server process instead of on every script rerun."""
+    load_dotenv(r'.env')
+    return True
+
+
+@st.cache_resource
+def _patch_loop():
+    """Apply nest_asyncio once per server process to allow nested event loops."""
+    import nest_asyncio
+    nest_asyncio.apply()
+    return True
 
-# Apply nest_asyncio to allow nested event loops
-nest_asyncio.apply()
 
 def display_message_part(part):
     """
@@ -40,46 +67,160 @@ def display_message_part(part):
             st.markdown(part.content)          
 
 
-async def stream_response(question: str) -> AsyncGenerator[str, None]:
-    """Stream the response from the WebSocket connection."""
-    async with websockets.connect(f"{WS_URL}/{SESSION_ID}") as websocket:
-        # Send the question
-        await websocket.send(json.dumps({"question": question}))
-        
-        # Stream the response
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of this browser session.
+    
+    The WebSocket connection is bound to the loop it was opened on, so the same loop
+    is reused across script reruns instead of creating one per asyncio.run call.
+    """
+    if "event_loop" not in st.session_state:
+        st.session_state.event_loop = asyncio.new_event_loop()
+    return st.session_state.event_loop
+
+
+async def get_websocket() -> websockets.ClientConnection:
+    """Return the session's open WebSocket connection, connecting if needed.
+    
+    A connection whose last response was not read to the end (e.g. the script rerun
+    mid-stream) is replaced, so leftover frames cannot leak into the next answer.
+    """
+    websocket = st.session_state.get("websocket")
+    if websocket is not None and st.session_state.get("websocket_pending"):
+        await websocket.close()
+        websocket = None
+    if websocket is None or websocket.state is not State.OPEN:
+        # Frames are small JSON tokens over a local connection, so deflate is pure overhead
+        websocket = await websockets.connect(
+            f"{WS_URL}/{SESSION_ID}",
+            compression=None,
+            max_size=WS_MAX_FRAME_SIZE
+        )
+        st.session_state.websocket = websocket
+    return websocket
+
+
+async def send_question(question: str) -> websockets.ClientConnection:
+    """Send a question over the session's WebSocket, reconnecting once if it was closed."""
+    # Decoded to str so it is sent as a text frame, as the server's receive_json expects
+    message = orjson.dumps({"question": question}).decode()
+    websocket = await get_websocket()
+    try:
+        await websocket.send(message)
+    except websockets.exceptions.ConnectionClosed:
+        st.session_state.websocket = None
+        websocket = await get_websocket()
+        await websocket.send(message)
+    st.session_state.websocket_pending = True
+    return websocket
+
+
+# Frames sent by the server, tagged by their "type" field
+class Chunk(msgspec.Struct, tag="chunk"):
+    content: str
+
+
+class Complete(msgspec.Struct, tag="complete"):
+    new_messages: List[dict]
+
+
+class Error(msgspec.Struct, tag="error"):
+    content: str
+
+
+Frame = Union[Chunk, Complete, Error]
+frame_decoder = msgspec.json.Decoder(Frame)
+
+
+async def receive_frames(websocket: websockets.ClientConnection, queue: asyncio.Queue) -> None:
+    """Receive and decode frames of the current response into queue, up to its last frame.
+    
+    A closed connection is queued as None, any other failure as the exception itself.
+    """
+    try:
         while True:
-            try:
-                response = await websocket.recv()
-                data = json.loads(response)
+            frame = frame_decoder.decode(await websocket.recv())
+            queue.put_nowait(frame)
+            if not isinstance(frame, Chunk):
+                return
+    except websockets.exceptions.ConnectionClosed:
+        queue.put_nowait(None)
+    except Exception as e:
+        queue.put_nowait(e)
+
+
+async def stream_response(question: str) -> AsyncGenerator[str, None]:
+    """Send a question over the session's WebSocket and stream the response.
+    
+    Frames are received by a separate task while the UI renders. Every chunk queued
+    in the meantime is joined and yielded together, so a slow render is followed by
+    a single catch-up update instead of one per frame.
+    
+    Nothing answers the server's keepalive pings between script reruns, so an idle
+    connection may turn out to be closed only once the question is sent. If it closes
+    before the first frame, the question is sent once more over a new connection; a
+    connection lost mid-response is reported as an error.
+    """
+    for _ in range(2):
+        websocket = await send_question(question)
+        queue: asyncio.Queue = asyncio.Queue()
+        receiver = asyncio.create_task(receive_frames(websocket, queue))
+        received = False
+        try:
+            while True:
+                # Wait for the next frame, then drain whatever else has already arrived
+                frames = [await queue.get()]
+                frames.extend(queue.get_nowait() for _ in range(queue.qsize()))
                 
-                if data["type"] == "chunk":
-                    yield data["content"]
-                elif data["type"] == "complete":
-                    # Extract just the user question and assistant response
-                    for msg in data["new_messages"]:
-                        if msg["type"] == "ModelRequest":
-                            # Add user question if it has content
-                            content = next((part["content"] for part in msg["parts"] if part["part_kind"] == "user-prompt"), None)
-                            if content:
-                                st.session_state.messages.append({
-                                    "role": "user",
-                                    "content": content
-                                })
-                        elif msg["type"] == "ModelResponse":
-                            # Add assistant response if it has content
-                            content = next((part["content"] for part in msg["parts"] if part["part_kind"] == "text"), None)
-                            if content:
-                                st.session_state.messages.append({
-                                    "role": "assistant",
-                                    "content": content
-                                })
-                    break
-                elif data["type"] == "error":
-                    st.error(f"Error: {data['content']}")
+                chunks = [frame.content for frame in frames if isinstance(frame, Chunk)]
+                if chunks:
+                    yield "".join(chunks)
+                
+                frame = frames[-1]
+                if not isinstance(frame, Chunk):
+                    received = received or len(frames) > 1
                     break
-                    
-            except websockets.exceptions.ConnectionClosed:
-                break
+                received = True
+        finally:
+            receiver.cancel()
+        
+        # The connection is gone either way, the next question opens a new one
+        if frame is None:
+            st.session_state.websocket = None
+            st.session_state.websocket_pending = False
+        if frame is not None or received:
+            break
+    
+    if frame is None:
+        st.error("Error: the connection to the server was lost, please ask again.")
+    elif isinstance(frame, Exception):
+        raise frame
+    
+    if isinstance(frame, Complete):
+        # Extract just the user question and assistant response
+        for msg in frame.new_messages:
+            # Index the parts by kind, built in reverse so the first part of each kind wins
+            # (tool call parts carry args instead of content)
+            parts_by_kind = {part["part_kind"]: part.get("content") for part in reversed(msg["parts"])}
+            if msg["type"] == "ModelRequest":
+                # Add user question if it has content
+                content = parts_by_kind.get("user-prompt")
+                if content:
+                    st.session_state.messages.append({
+                        "role": "user",
+                        "content": content
+                    })
+            elif msg["type"] == "ModelResponse":
+                # Add assistant response if it has content
+                content = parts_by_kind.get("text")
+                if content:
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": content
+                    })
+        st.session_state.websocket_pending = False
+    elif isinstance(frame, Error):
+        st.error(f"Error: {frame.content}")
+        st.session_state.websocket_pending = False
 
 
 def display_message(message):
@@ -87,16 +228,68 @@ def display_message(message):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
+def show_earlier_messages():
+    """Widen the history window, run before the rerun triggered by the "Show earlier" click."""
+    st.session_state.history_window += HISTORY_WINDOW
+
+@st.fragment
+def render_history():
+    """Display the tail of the conversation so far.
+    
+    Only the last history_window messages are drawn, widened by HISTORY_WINDOW each time
+    "Show earlier" is clicked. Running as a fragment, the click reruns just the history.
+    """
+    messages = st.session_state.messages
+    window = st.session_state.setdefault("history_window", HISTORY_WINDOW)
+    if len(messages) > window:
+        st.button(f"Show earlier ({len(messages) - window} hidden)", on_click=show_earlier_messages)
+    
+    for message in messages[-window:]:
+        display_message(message)
+
+def render_assistant_response(user_input: str):
+    """Stream the assistant's response to user_input into its own chat bubble."""
+    with st.chat_message("assistant"):
+        # Create placeholders for the streaming text and the cursor below it
+        message_placeholder = st.empty()
+        cursor_placeholder = st.empty()
+        cursor_placeholder.markdown(CURSOR_HTML, unsafe_allow_html=True)
+        full_response = ""
+        
+        # Stream the response as plain text, re-rendering every RENDER_INTERVAL seconds once it
+        # has grown by RENDER_MIN_GROWTH characters, or right away once RENDER_MAX_PENDING are pending
+        async def process_stream():
+            nonlocal full_response
+            last_render = 0.0
+            last_len = 0
+            async for chunk in stream_response(user_input):
+                full_response += chunk
+                pending = len(full_response) - last_len
+                if pending < RENDER_MIN_GROWTH:
+                    continue
+                now = time.monotonic()
+                if pending >= RENDER_MAX_PENDING or now - last_render >= RENDER_INTERVAL:
+                    message_placeholder.text(full_response)
+                    last_render = now
+                    last_len = len(full_response)
+            # Parse the markdown once the full response is there, then remove the cursor
+            message_placeholder.markdown(full_response)
+            cursor_placeholder.empty()
+        
+        get_event_loop().run_until_complete(process_stream())
+
 def main():
+    _load_env()
+    _patch_loop()
+
     st.title("HR AI assistant")
 
     # Initialize empty message history
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
-    # Display all messages from the conversation so far
-    for message in st.session_state.messages:
-        display_message(message)
+    # Display the latest messages from the conversation so far
+    render_history()
 
     # Chat input for the user
     user_input = st.chat_input("What do you want to know?")
@@ -107,19 +300,7 @@ def main():
             st.markdown(user_input)
 
         # Display the assistant's response
-        with st.chat_message("assistant"):
-            # Create a placeholder for the streaming text
-            message_placeholder = st.empty()
-            full_response = ""
-            
-            # Stream the response
-            async def process_stream():
-                nonlocal full_response
-                async for chunk in stream_response(user_input):
-                    full_response += chunk
-                    message_placeholder.markdown(full_response + "▌")
-            
-            asyncio.run(process_stream())
+        render_assistant_response(user_input)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""Test script for embedding_batcher.py."""
+
+import asyncio
+import pytest
+from src.embedding_batcher import EmbedBatcher
+
+class FakeEmbedder:
+    """Embedding function that records its calls and embeds each text as a tagged string."""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, texts):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("embedding failed")
+        return [f"embedding of {text}" for text in texts]
+
+def count_characters(texts):
+    """Count one token per character so the limits are easy to reason about."""
+    return sum(len(text) for text in texts)
+
+def embed_concurrently(requests, embedder, max_texts=100, max_tokens=100):
+    """Submit all requests at once and return what each caller received."""
+    async def submit():
+        batcher = EmbedBatcher(embedder, count_characters, max_texts=max_texts, max_tokens=max_tokens, timeout=0.05)
+        return await asyncio.gather(*(batcher.embed(texts) for texts in requests), return_exceptions=True)
+    return asyncio.run(submit())
+
+def test_embed_batcher_coalesces_requests():
+    """Test that concurrent requests share one call and each caller gets its own slice."""
+    embedder = FakeEmbedder()
+    results = embed_concurrently([["a", "b"], ["c"], ["d", "e"]], embedder)
+
+    assert embedder.calls == [["a", "b", "c", "d", "e"]]
+    assert results == [
+        ["embedding of a", "embedding of b"],
+        ["embedding of c"],
+        ["embedding of d", "embedding of e"],
+    ]
+
+def test_embed_batcher_respects_text_limit():
+    """Test that a request that would exceed max_texts is held back for the next batch."""
+    embedder = FakeEmbedder()
+    results = embed_concurrently([["a", "b"], ["c", "d"], ["e"]], embedder, max_texts=3)
+
+    assert embedder.calls == [["a", "b"], ["c", "d", "e"]]
+    assert results == [
+        ["embedding of a", "embedding of b"],
+        ["embedding of c", "embedding of d"],
+        ["embedding of e"],
+    ]
+
+def test_embed_batcher_respects_token_limit():
+    """Test that a request that would exceed max_tokens is held back for the next batch."""
+    embedder = FakeEmbedder()
+    results = embed_concurrently([["aaaa"], ["bbbb"], ["cc"]], embedder, max_tokens=6)
+
+    assert embedder.calls == [["aaaa"], ["bbbb", "cc"]]
+    assert results == [["embedding of aaaa"], ["embedding of bbbb"], ["embedding of cc"]]
+
+def test_embed_batcher_sends_oversized_request_alone():
+    """Test that a single request over the limits is sent on its own instead of being dropped."""
+    embedder = FakeEmbedder()
+    results = embed_concurrently([["x" * 10], ["y"]], embedder, max_tokens=5)
+
+    assert embedder.calls == [["x" * 10], ["y"]]
+    assert results == [["embedding of " + "x" * 10], ["embedding of y"]]
+
+def test_embed_batcher_propagates_failures():
+    """Test that a failed call is raised to every caller of the batch."""
+    embedder = FakeEmbedder(fail=True)
+    results = embed_concurrently([["a"], ["b"]], embedder)
+
+    assert embedder.calls == [["a", "b"]]
+    assert all(isinstance(result, RuntimeError) for result in results)
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        raise results[0]
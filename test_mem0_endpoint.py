@@ -1,15 +1,21 @@
 import os
+import orjson
+from operator import itemgetter
 from dotenv import load_dotenv
 from mem0 import MemoryClient
-from rich.console import Console
+from rich.console import Console, Group
 from rich.panel import Panel
 from rich.table import Table
-from rich.json import JSON
+from rich.syntax import Syntax
 from rich import print as rprint
 
 # Initialize rich console
 console = Console()
 
+def json_syntax(data):
+    """Serialize data once with orjson and wrap it for highlighted display."""
+    return Syntax(orjson.dumps(data, option=orjson.OPT_INDENT_2).decode(), "json")
+
 # Load environment variables
 load_dotenv(r'.env')
 
@@ -37,11 +43,11 @@ def test_create_memory():
     table.add_column("Role", style="cyan")
     table.add_column("Content", style="green")
     
-    for msg in messages:
-        table.add_row(msg["role"], msg["content"])
+    for row in map(itemgetter("role", "content"), messages):
+        table.add_row(*row)
     
-    console.print(Panel(table, title="Memory Creation Result"))
-    console.print(Panel(JSON.from_data(result), title="API Response"))
+    # Render the table and the raw response in a single layout pass
+    console.print(Panel(Group(table, Panel(json_syntax(result), title="API Response")), title="Memory Creation Result"))
     return result
 
 def test_search_memories():
@@ -55,15 +61,14 @@ def test_search_memories():
     table.add_column("Content", style="green")
     table.add_column("Score", style="yellow")
     
-    for memory in related_memories:
-        table.add_row(
-            str(memory.get("id", "N/A")),
-            str(memory.get("content", "N/A")),
-            str(memory.get("score", "N/A"))
-        )
+    rows = [
+        (str(memory.get("id", "N/A")), str(memory.get("content", "N/A")), str(memory.get("score", "N/A")))
+        for memory in related_memories
+    ]
+    for row in rows:
+        table.add_row(*row)
     
-    console.print(Panel(table, title=f"Search Results for Query: '{query}'"))
-    console.print(Panel(JSON.from_data(related_memories), title="Raw API Response"))
+    console.print(Panel(Group(table, Panel(json_syntax(related_memories), title="Raw API Response")), title=f"Search Results for Query: '{query}'"))
     return related_memories
 
 def test_retrieve_memory():
@@ -76,15 +81,14 @@ def test_retrieve_memory():
     table.add_column("Content", style="green")
     table.add_column("Created At", style="yellow")
     
-    for memory in all_memories:
-        table.add_row(
-            str(memory.get("id", "N/A")),
-            str(memory.get("content", "N/A")),
-            str(memory.get("created_at", "N/A"))
-        )
+    rows = [
+        (str(memory.get("id", "N/A")), str(memory.get("content", "N/A")), str(memory.get("created_at", "N/A")))
+        for memory in all_memories
+    ]
+    for row in rows:
+        table.add_row(*row)
     
-    console.print(Panel(table, title="All Retrieved Memories"))
-    console.print(Panel(JSON.from_data(all_memories), title="Raw API Response"))
+    console.print(Panel(Group(table, Panel(json_syntax(all_memories), title="Raw API Response")), title="All Retrieved Memories"))
     return all_memories
 
 if __name__ == "__main__":
@@ -0,0 +1,59 @@
+"""Test script for message_history.py functions."""
+
+from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, UserPromptPart, TextPart
+from src.message_history import trim_history, cache_namespace
+
+def build_history(turns):
+    """Build a conversation with a system prompt and the given number of turns."""
+    history = [
+        ModelRequest(parts=[SystemPromptPart(content="system"), UserPromptPart(content="question 0")]),
+        ModelResponse(parts=[TextPart(content="answer 0")]),
+    ]
+    for i in range(1, turns):
+        history.append(ModelRequest(parts=[UserPromptPart(content=f"question {i}")]))
+        history.append(ModelResponse(parts=[TextPart(content=f"answer {i}")]))
+    return history
+
+def test_trim_history():
+    """Test that trimmed histories start at a user prompt and keep the system prompt."""
+    history = build_history(4)
+
+    # Short histories are passed through as they are
+    assert trim_history(history, max_messages=len(history)) is history
+
+    # The last 5 messages start mid-turn, so the trimmed history starts at the next user prompt
+    trimmed = trim_history(history, max_messages=5)
+    assert len(trimmed) == 4
+    assert [part.part_kind for part in trimmed[0].parts] == ["system-prompt", "user-prompt"]
+    assert trimmed[0].parts[0].content == "system"
+    assert trimmed[0].parts[1].content == "question 2"
+    assert trimmed[1:] == history[5:]
+
+def test_cache_namespace():
+    """Test that namespaces are scoped to the user and to the conversation so far."""
+    history = build_history(2)
+
+    # The same conversation maps to the same namespace
+    assert cache_namespace("user", history) == cache_namespace("user", build_history(2))
+    assert cache_namespace("user", history).startswith("user:")
+
+    # Other users, other conversations and longer conversations get their own namespace
+    assert cache_namespace("user", history) != cache_namespace("other", history)
+    assert cache_namespace("user", history) != cache_namespace("user", history[:2])
+    assert cache_namespace("user", history) != cache_namespace("user", build_history(3))
+    assert cache_namespace("user", []) != cache_namespace("user", history)
+
+    # Memory writes move the user to a new namespace
+    assert cache_namespace("user", history, memory_version=1) != cache_namespace("user", history)
+    assert cache_namespace("user", history, memory_version=1) == cache_namespace("user", history, memory_version=1)
+
+    # Prompts and answers are not interchangeable
+    swapped = [
+        ModelRequest(parts=[UserPromptPart(content="answer 0")]),
+        ModelResponse(parts=[TextPart(content="question 0")]),
+    ]
+    unswapped = [
+        ModelRequest(parts=[UserPromptPart(content="question 0")]),
+        ModelResponse(parts=[TextPart(content="answer 0")]),
+    ]
+    assert cache_namespace("user", swapped) != cache_namespace("user", unswapped)
@@ -1,5 +1,6 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import orjson
 from rich.console import Console
 from rich.panel import Panel
 from rich.json import JSON
@@ -13,6 +14,9 @@ BASE_URL = "http://localhost:8001"
 console = Console()
 
 def test_rag_endpoints():
+    # Reuse one keep-alive connection for all requests to the server
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
 
     # First query
     console.print(Panel.fit("First Query", style="bold green"))
@@ -21,7 +25,7 @@ def test_rag_endpoints():
         "message_history": []
     }
     
-    first_response = requests.post(
+    first_response = session.post(
         f"{BASE_URL}/query",
         json=first_query,
         params={"session_id": SESSION_ID}
@@ -36,13 +40,15 @@ def test_rag_endpoints():
     console.print()
 
     # Second query (follow-up)
+    # Must run after the first query: it asks about the previous question, which the
+    # server only knows once the first turn is stored in this session's history
     console.print(Panel.fit("Second Query (Follow-up)", style="bold green"))
     second_query = {
         "question": "What was my last question about?",
         "message_history": []
     }
     
-    second_response = requests.post(
+    second_response = session.post(
         f"{BASE_URL}/query",
         json=second_query,
         params={"session_id": SESSION_ID}
@@ -58,14 +64,14 @@ def test_rag_endpoints():
     
     # Test message history endpoint
     console.print(Panel.fit(f"Message History for Session: {SESSION_ID}", style="bold yellow"))
-    history_response = requests.get(
+    history_response = session.get(
         f"{BASE_URL}/message-history/{SESSION_ID}"
     )
     
     console.print("Message History:")
     for msg in history_response.json():
         console.print(Panel(
-            JSON(json.dumps(msg, indent=2)),
+            JSON(orjson.dumps(msg, option=orjson.OPT_INDENT_2).decode()),
             title="Message",
             border_style="yellow"
         ))
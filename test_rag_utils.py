@@ -3,13 +3,15 @@
 import os
 import asyncio
 import pytest
+import numpy as np
 from neo4j import GraphDatabase
-from src.rag_utils import get_neo4j_driver, get_all_entities, get_embeddings_by_entity_type, compute_similarity_metrics, merge_similar_entities
-from src.rag_agent import initialize_rag
+from sklearn.metrics.pairwise import pairwise_distances
+from src import rag_utils
+from src.rag_utils import get_neo4j_driver, get_all_entities, get_embeddings_by_entity_type, compute_similarity_metrics, merge_similar_entities, group_merge_components
 
 def test_get_all_entities():
     """Test the get_all_entities function to ensure it correctly retrieves entities from Neo4j."""
-    # Get Neo4j driver
+    # Get the shared Neo4j driver (closed at interpreter exit, so not closed here)
     driver = get_neo4j_driver()
     
     try:
@@ -39,11 +41,109 @@ def test_get_all_entities():
             
     except Exception as e:
         pytest.fail(f"Test failed with error: {str(e)}")
-    finally:
-        # Close the driver connection
-        driver.close()
+
+def test_group_merge_components():
+    """Test that chains of similar pairs are merged into one component with the right target."""
+    # A~B and B~C form one chain; the target of the strongest pair comes first
+    assert group_merge_components([("B", "A"), ("C", "B"), ("E", "D")]) == [["A", "B", "C"], ["D", "E"]]
+    
+    # The strongest pair decides the target of the whole chain, even if it joins later pairs
+    assert group_merge_components([("B", "C"), ("A", "B")]) == [["C", "B", "A"]]
+    
+    # Repeated and reversed pairs do not duplicate members
+    assert group_merge_components([("B", "A"), ("A", "B"), ("B", "A")]) == [["A", "B"]]
+    
+    assert group_merge_components([]) == []
+
+def clustered_embeddings(clusters=3, per_cluster=4, dim=16, seed=0):
+    """Build tight clusters of random vectors so no similarity sits close to a threshold."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    embeddings = np.repeat(centers, per_cluster, axis=0)
+    embeddings += 0.01 * rng.normal(size=embeddings.shape)
+    entity_names = [f"entity_{i}" for i in range(len(embeddings))]
+    return {"entity_names": entity_names, "embeddings": embeddings.astype(np.float32)}
+
+def baseline_pairs(data, metric, threshold):
+    """Similar pairs from the full distance matrix and a double loop over the upper triangle."""
+    embeddings, entity_names = data["embeddings"], data["entity_names"]
+    distances = pairwise_distances(embeddings, metric=metric)
+    if metric in ['cosine', 'correlation', 'jaccard']:
+        similarities = 1 - distances
+    else:
+        similarities = 1 / (1 + distances)
+    
+    pairs = {}
+    for i in range(len(entity_names)):
+        for j in range(i + 1, len(entity_names)):
+            if similarities[i, j] >= threshold:
+                pairs[(entity_names[i], entity_names[j])] = similarities[i, j]
+    return pairs, similarities
+
+@pytest.fixture(params=["numpy", "numba", "faiss"])
+def similarity_backend(request, monkeypatch):
+    """Force one pair collection backend by hiding the optional libraries of the others."""
+    if request.param == "numba" and rag_utils.njit is None:
+        pytest.skip("numba is not installed")
+    if request.param == "faiss" and rag_utils.faiss is None:
+        pytest.skip("faiss is not installed")
+    if request.param != "numba":
+        monkeypatch.setattr(rag_utils, "njit", None)
+    if request.param != "faiss":
+        monkeypatch.setattr(rag_utils, "faiss", None)
+    return request.param
+
+@pytest.mark.parametrize("return_similarities", [True, False])
+@pytest.mark.parametrize("metric, threshold", [
+    ("cosine", 0.8),
+    ("correlation", 0.8),
+    ("euclidean", 0.5),
+    ("manhattan", 0.5),
+    ("jaccard", 0.5),
+    ("nan_euclidean", 0.5),  # Not known to pdist, goes through pairwise_distances
+])
+def test_compute_similarity_metrics(similarity_backend, metric, threshold, return_similarities):
+    """Test that pairs and scores match the full-matrix baseline on synthetic embeddings."""
+    data = clustered_embeddings()
+    expected_pairs, expected_similarities = baseline_pairs(data, metric, threshold)
+    
+    results = asyncio.run(compute_similarity_metrics(
+        {"PERSON": data}, metric=metric, threshold=threshold, return_similarities=return_similarities
+    ))
+    result = results["PERSON"]
+    
+    pairs = {(source, target): similarity for source, target, similarity in result["pairs"]}
+    assert pairs.keys() == expected_pairs.keys(), "Pairs should match the baseline"
+    for pair, similarity in pairs.items():
+        assert similarity == pytest.approx(expected_pairs[pair], abs=1e-5), f"Score of {pair} should match the baseline"
+    
+    scores = [similarity for _, _, similarity in result["pairs"]]
+    assert scores == sorted(scores, reverse=True), "Pairs should be sorted by descending similarity"
+    
+    if return_similarities:
+        np.testing.assert_allclose(result["similarities"], expected_similarities, atol=1e-5)
+    else:
+        assert result["similarities"] is None
+
+@pytest.mark.parametrize("metric", ["cosine", "euclidean", "nan_euclidean"])
+def test_compute_similarity_metrics_small_groups(similarity_backend, metric):
+    """Test that groups with a single entity or none at all produce no pairs."""
+    single = clustered_embeddings(clusters=1, per_cluster=1)
+    empty = {"entity_names": [], "embeddings": np.zeros((0, 16), dtype=np.float32)}
+    
+    results = asyncio.run(compute_similarity_metrics(
+        {"PERSON": single, "ORGANIZATION": empty}, metric=metric, threshold=0.5
+    ))
+    
+    assert results["PERSON"]["pairs"] == []
+    assert results["PERSON"]["similarities"].shape == (1, 1)
+    assert results["ORGANIZATION"]["pairs"] == []
+    assert results["ORGANIZATION"]["similarities"].shape == (0, 0)
 
 async def test_entity_similarity():
+    # Imported here so the synthetic tests above run without the agent's API keys
+    from src.rag_agent import initialize_rag
+    
     # Initialize RAG
     rag = await initialize_rag()
     
@@ -61,7 +161,8 @@ async def test_entity_similarity():
     similarity_results = await compute_similarity_metrics(
         embeddings_by_type,
         metric='cosine',
-        threshold=0.8  # Adjust this threshold as needed
+        threshold=0.8,  # Adjust this threshold as needed
+        return_similarities=False  # Only the pairs are printed below
     )
     
     # Print results for each entity type